@@ -1,27 +1,57 @@
 # This script runs a continuous 'Random ARGB Rain' light show 
 # on the Novation Launchkey 25 MK2 pads in the Windows background.
 # 
-# Requires: Python, and the 'mido' and 'python-rtmidi' libraries.
-# Installation: pip install mido python-rtmidi
+# Requires: Python, and the 'python-rtmidi' library.
+# Installation: pip install python-rtmidi
 #
 # --- IMPORTANT: PORT NAME IS NOW READ FROM config.json ---
 
-import mido
+import rtmidi
 import time
 import random
 import sys
 import json
 import os
+import functools
+import array
+import heapq
+import queue
+import threading
+
+try:
+    import orjson # Optional: parses bytes directly and is much faster than json
+except ImportError:
+    orjson = None
 
 # Configuration constants
 CONFIG_FILE = 'config.json'
 DEFAULT_PORT = 'Launchkey 25 MK2 MIDI 2'
 MIDI_CHANNEL = 0 # MIDI Channel 1 (index 0)
-PAD_NOTES = list(range(36, 52)) # MIDI Notes 36 (C1) to 51 (D#2)
+NOTE_ON = 0x90 | MIDI_CHANNEL # Note On status byte for MIDI_CHANNEL
+PAD_NOTES = tuple(range(36, 52)) # MIDI Notes 36 (C1) to 51 (D#2)
 
 # Velocity values for colors (Based on Novation's color map)
 # We only use velocities > 0 for random colors.
-COLOR_VELOCITIES = [5, 13, 21, 56, 60, 64, 80, 127] # Red, Orange, Yellow, Green, Cyan, Blue, Purple, White
+COLOR_VELOCITIES = bytes((5, 13, 21, 56, 60, 64, 80, 127)) # Red, Orange, Yellow, Green, Cyan, Blue, Purple, White
+
+# Writer-thread limits: how many messages may wait for the port before new
+# ones are dropped, and how long shutdown waits for the send in progress.
+WRITER_QUEUE_SIZE = 32
+WRITER_STOP_TIMEOUT = 1.0 # seconds
+
+# Launchkey LED control port detection: the (casefolded) port name must contain
+# every keyword in PORT_REQUIRED_KEYWORDS and at least one in PORT_ANY_KEYWORDS.
+PORT_REQUIRED_KEYWORDS = ('launchkey',)
+PORT_ANY_KEYWORDS = ('midi 2', 'incontrol')
+
+# Every (note, velocity) pair the show can emit, built once so the hot loop
+# never has to build a fresh message per send. rtmidi takes these raw
+# (status, data1, data2) tuples as-is.
+PREBUILT = {
+    (note, velocity): (NOTE_ON, note, velocity)
+    for note in PAD_NOTES
+    for velocity in (*COLOR_VELOCITIES, 0)
+}
 
 def save_midi_port_name(port_name):
     """Saves the detected MIDI port name to config.json."""
@@ -33,12 +63,17 @@ def save_midi_port_name(port_name):
     except Exception as e:
         print(f"CRITICAL ERROR: Could not write {CONFIG_FILE}. Please check file permissions. Error: {e}")
 
+@functools.lru_cache(maxsize=1)
+def list_output_ports():
+    """Returns the MIDI output port names; enumerated once per process."""
+    return tuple(rtmidi.MidiOut().get_ports())
+
 def auto_detect_and_save_port():
     """Scans ports, guesses the Launchkey port, and saves the config automatically."""
     print("Attempting automatic MIDI port detection...")
     
     try:
-        output_names = mido.get_output_names()
+        output_names = list_output_ports()
     except Exception as e:
         print(f"Error accessing MIDI ports: {e}")
         return DEFAULT_PORT
@@ -46,9 +81,9 @@ def auto_detect_and_save_port():
     detected_port = None
     
     for name in output_names:
-        lower_name = name.lower()
-        # Look for 'launchkey' AND ('midi 2' OR 'incontrol')
-        if 'launchkey' in lower_name and ('midi 2' in lower_name or 'incontrol' in lower_name):
+        folded_name = name.casefold()
+        if (all(keyword in folded_name for keyword in PORT_REQUIRED_KEYWORDS)
+                and any(keyword in folded_name for keyword in PORT_ANY_KEYWORDS)):
             detected_port = name
             break
             
@@ -71,27 +106,32 @@ def auto_detect_and_save_port():
         return DEFAULT_PORT
 
 
+@functools.lru_cache(maxsize=1)
+def _parsed_config(mtime_ns):
+    """Reads and parses config.json; cached per modification time so an unchanged file is parsed once."""
+    with open(CONFIG_FILE, 'rb', buffering=0) as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
 def load_midi_port_name():
     """Reads the MIDI port name from config.json or attempts auto-detection."""
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                port_name = config.get('MIDI_PORT_NAME', DEFAULT_PORT)
-                print(f"Configuration loaded from {CONFIG_FILE}: Port '{port_name}'")
-                return port_name
-        except Exception as e:
-            print(f"Warning: Failed to read or parse {CONFIG_FILE}. Attempting auto-detection.")
-            return auto_detect_and_save_port()
-    else:
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
         # If config file is missing, try to auto-detect and save it
         return auto_detect_and_save_port()
 
+    try:
+        port_name = _parsed_config(mtime).get('MIDI_PORT_NAME', DEFAULT_PORT)
+        print(f"Configuration loaded from {CONFIG_FILE}: Port '{port_name}'")
+        return port_name
+    except Exception as e:
+        print(f"Warning: Failed to read or parse {CONFIG_FILE}. Attempting auto-detection.")
+        return auto_detect_and_save_port()
+
 def send_led_message(port, note, velocity):
     """Sends a MIDI Note On message (color setting) to the Launchkey pad."""
-    # Note On status byte is 0x90 (144) for channel 1 (index 0)
-    msg = mido.Message('note_on', channel=MIDI_CHANNEL, note=note, velocity=velocity)
-    port.send(msg)
+    port.send_message(PREBUILT[(note, velocity)])
 
 def clear_all_pads(port):
     """Turns off all the pad LEDs."""
@@ -99,52 +139,240 @@ def clear_all_pads(port):
     for note in PAD_NOTES:
         send_led_message(port, note, 0) # Velocity 0 turns the LED off
 
-def run_rain_pattern(port):
-    """Runs the continuous random ARGB rain light show."""
-    print(f"Starting 'Random ARGB Rain' on {port.name}. Press Ctrl+C to stop.")
+def open_output_port(port_name):
+    """Opens the named MIDI output port directly through python-rtmidi.
+
+    Raises ValueError if no output port with that name exists.
+    """
+    midi_out = rtmidi.MidiOut()
+    port_index = midi_out.get_ports().index(port_name)
+    midi_out.open_port(port_index)
+    return midi_out
+
+def boost_priority(process_wide=True):
+    """Raises the scheduling priority of the calling thread to reduce timing jitter.
+
+    On Windows this also registers the thread with the Multimedia Class Scheduler
+    Service as a "Pro Audio" task. With process_wide=True it additionally raises
+    the process priority class and requests 1 ms timer resolution, and reports
+    failures; extra threads pass False so this is done, and warned about, once.
+    Returns (timer_period_raised, mmcss_handle) describing what was actually
+    changed; pass it to restore_priority() from the same thread when the show stops.
+    """
+    timer_period_raised = False
+    mmcss_handle = None
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+            kernel32 = ctypes.windll.kernel32
+            if process_wide:
+                kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x00000080) # HIGH_PRIORITY_CLASS
+                timer_period_raised = ctypes.windll.winmm.timeBeginPeriod(1) == 0 # TIMERR_NOERROR
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 15) # THREAD_PRIORITY_TIME_CRITICAL
+            avrt = ctypes.windll.avrt
+            avrt.AvSetMmThreadCharacteristicsW.restype = wintypes.HANDLE
+            task_index = wintypes.DWORD(0)
+            mmcss_handle = avrt.AvSetMmThreadCharacteristicsW('Pro Audio', ctypes.byref(task_index)) or None
+        elif hasattr(os, 'sched_setscheduler'):
+            priority = os.sched_get_priority_min(os.SCHED_FIFO)
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except Exception as e:
+        if process_wide:
+            print(f"Warning: Could not raise scheduling priority, timing may be less stable. Error: {e}")
+    return timer_period_raised, mmcss_handle
+
+def restore_priority(priority_state):
+    """Undoes the Windows timer resolution and MMCSS registration from boost_priority()."""
+    timer_period_raised, mmcss_handle = priority_state
+    if mmcss_handle is not None:
+        import ctypes
+        from ctypes import wintypes
+        avrt = ctypes.windll.avrt
+        avrt.AvRevertMmThreadCharacteristics.argtypes = [wintypes.HANDLE]
+        avrt.AvRevertMmThreadCharacteristics(mmcss_handle)
+    if timer_period_raised:
+        import ctypes
+        ctypes.windll.winmm.timeEndPeriod(1)
+
+def open_tick_timer(interval):
+    """Creates a periodic CLOCK_MONOTONIC timerfd firing every `interval` seconds.
+
+    Returns the file descriptor, or None where timerfd is unavailable (anything
+    but Linux on Python 3.13+), in which case callers fall back to time.sleep().
+    """
+    if not hasattr(os, 'timerfd_create'):
+        return None
+    try:
+        timer_fd = os.timerfd_create(time.CLOCK_MONOTONIC)
+        os.timerfd_settime(timer_fd, initial=interval, interval=interval)
+        return timer_fd
+    except OSError:
+        return None
+
+def midi_writer(port, messages, errors):
+    """Sends queued raw MIDI messages to the port until a None sentinel arrives.
+
+    Runs on its own thread so a stalled port.send_message() never delays the
+    light-show scheduler. If sending fails, the exception is appended to
+    `errors` for the scheduler to re-raise and the thread stops.
+    """
+    priority_state = boost_priority(process_wide=False)
+    send = port.send_message
+    try:
+        for message in iter(messages.get, None):
+            send(message)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        restore_priority(priority_state)
+
+def run_rain_pattern(port, port_name):
+    """Runs the continuous random ARGB rain light show.
+
+    Returns False if the MIDI writer thread is still stuck in a send when the
+    show stops; the port must then not be closed from this thread.
+    """
+    print(f"Starting 'Random ARGB Rain' on {port_name}. Press Ctrl+C to stop.")
     
-    active_lights = {} 
     INTERVAL_SECONDS = 0.05 
     LIGHT_DURATION = 0.5 
 
+    # Set up inside the try so the finally below always undoes whatever part
+    # of the setup completed.
+    priority_state = None
+    writer = None
+    timer_fd = None
+
     try:
+        priority_state = boost_priority()
+        # Hand messages to the writer thread instead of blocking on the port here.
+        # The queue is kept shallow: if the writer falls behind, new drops are
+        # skipped and note-offs retried rather than piling up or stalling the tick.
+        messages = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        writer_errors = []
+        writer = threading.Thread(target=midi_writer, args=(port, messages, writer_errors), daemon=True)
+        writer.start()
+        send = messages.put_nowait
+        Full = queue.Full
+        # One getrandbits() call picks both pad and colour: the low bits index
+        # PAD_NOTES, the high bits COLOR_VELOCITIES. Both lengths must be powers
+        # of two so every bit pattern maps to a valid, uniform choice.
+        pads = PAD_NOTES
+        colors = COLOR_VELOCITIES
+        assert not (len(pads) & (len(pads) - 1) or len(colors) & (len(colors) - 1)), \
+            "PAD_NOTES and COLOR_VELOCITIES lengths must be powers of two"
+        pad_bits = len(pads).bit_length() - 1
+        pad_mask = len(pads) - 1
+        random_bits = pad_bits + len(colors).bit_length() - 1
+        # Messages looked up by plain index in the loop: drop_messages[r] is the
+        # Note-On for random value r, off_messages[i] the Note-Off for pad i.
+        drop_messages = tuple(PREBUILT[(pads[r & pad_mask], colors[r >> pad_bits])]
+                              for r in range(1 << random_bits))
+        off_messages = tuple(PREBUILT[(note, 0)] for note in pads)
+        # Expiry time per pad index; 0.0 means the pad is dark
+        expiry = array.array('d', [0.0] * len(PAD_NOTES))
+        # Min-heap of (expiry_time, pad index). A pad re-lit before it expired leaves a
+        # stale entry behind; it is skipped because it no longer matches expiry[].
+        pending = []
+
+        # Bind everything the loop touches to locals (LOAD_FAST instead of a
+        # global/attribute lookup on every tick).
+        monotonic = time.monotonic
+        sleep = time.sleep
+        getrandbits = random.getrandbits
+        heappop = heapq.heappop
+        heappush = heapq.heappush
+        read = os.read
+
+        # Ticks are scheduled against a fixed monotonic grid so time spent sending
+        # does not accumulate on top of the sleep. A timerfd wakes up far more
+        # precisely than time.sleep() where the platform provides one.
+        timer_fd = open_tick_timer(INTERVAL_SECONDS)
+        next_tick = monotonic()
+
         while True:
+            # Stop the show if the writer thread could not send (e.g. device unplugged)
+            if writer_errors:
+                raise writer_errors[0]
+
             # 1. Check and turn off lights that have expired
-            now = time.time()
-            notes_to_clear = [note for note, expiry_time in active_lights.items() if now >= expiry_time]
-            
-            for note in notes_to_clear:
-                send_led_message(port, note, 0)
-                del active_lights[note]
+            now = monotonic()
+            while pending and pending[0][0] <= now:
+                expiry_time, pad = heappop(pending)
+                if expiry[pad] == expiry_time:
+                    try:
+                        send(off_messages[pad])
+                        expiry[pad] = 0.0
+                    except Full:
+                        # Never lose a note-off: retry it on the next tick
+                        retry_time = now + INTERVAL_SECONDS
+                        expiry[pad] = retry_time
+                        heappush(pending, (retry_time, pad))
 
             # 2. Pick a random pad and color for the new 'rain drop'
-            random_note = random.choice(PAD_NOTES)
-            random_velocity = random.choice(COLOR_VELOCITIES)
+            r = getrandbits(random_bits)
+            pad = r & pad_mask
             
             # 3. Light up the pad and set its expiry time
-            send_led_message(port, random_note, random_velocity)
-            active_lights[random_note] = now + LIGHT_DURATION
+            try:
+                send(drop_messages[r])
+            except Full:
+                pass # A skipped drop is harmless
+            expiry_time = now + LIGHT_DURATION
+            expiry[pad] = expiry_time
+            heappush(pending, (expiry_time, pad))
 
-            time.sleep(INTERVAL_SECONDS)
+            # 4. Sleep until the next tick on the grid
+            if timer_fd is not None:
+                read(timer_fd, 8) # Blocks until the next expiry; missed ticks collapse into one
+            else:
+                next_tick += INTERVAL_SECONDS
+                slack = next_tick - monotonic()
+                if slack > 0:
+                    sleep(slack)
+                else:
+                    next_tick = monotonic() # Fell behind; resync instead of bursting
 
     except KeyboardInterrupt:
         print("\nStopping script...")
     except Exception as e:
         print(f"\nAn error occurred during pattern execution: {e}")
     finally:
-        clear_all_pads(port)
+        if timer_fd is not None:
+            os.close(timer_fd)
+        if writer is not None:
+            # Discard the backlog so the writer only has to finish its current
+            # send before it sees the sentinel and the pads can be cleared.
+            try:
+                while True:
+                    messages.get_nowait()
+            except queue.Empty:
+                pass
+            messages.put_nowait(None)
+            writer.join(timeout=WRITER_STOP_TIMEOUT)
+        port_idle = writer is None or not writer.is_alive()
+        if not port_idle:
+            print("Warning: MIDI port is not responding; skipping pad clearing and leaving the port open.")
+        else:
+            clear_all_pads(port)
+        if priority_state is not None:
+            restore_priority(priority_state)
+
+    return port_idle
 
 if __name__ == "__main__":
     
     MIDI_PORT_NAME = load_midi_port_name()
+    port_idle = True
 
     try:
         # 1. Open the MIDI port
-        output_port = mido.open_output(MIDI_PORT_NAME)
+        output_port = open_output_port(MIDI_PORT_NAME)
         print(f"Successfully connected to MIDI port: {MIDI_PORT_NAME}")
         
         # 2. Run the light show
-        run_rain_pattern(output_port)
+        port_idle = run_rain_pattern(output_port, MIDI_PORT_NAME)
 
     except ValueError:
         print(f"Error: Could not find or open the MIDI port named '{MIDI_PORT_NAME}'.")
@@ -152,5 +380,6 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"An unexpected error occurred during setup: {e}")
     finally:
-        if 'output_port' in locals() and output_port.opened:
-            output_port.close()
+        # Never close the port under a writer thread that is still sending
+        if port_idle and 'output_port' in locals() and output_port.is_port_open():
+            output_port.close_port()